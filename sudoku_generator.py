@@ -12,7 +12,20 @@ Copyright (c) 2024 ddotplus@github
 """
 
 import numpy as np
-import random
+import hashlib
+import math
+import numbers
+from functools import lru_cache
+try:
+    from numba import njit
+except ImportError:                 ## numba is optional, kernels then run as
+    def njit(*args, **kwargs):      ##   plain (slower) Python functions
+        if len(args) == 1 and callable(args[0]):
+            return args[0]
+        return lambda func: func
+
+## max size of Sudoku array, as digits are kept in uint32 bitmasks
+_MAX_SIZE = 32
 
 def available_digits(sudoku_array, pos_x=None, pos_y=None):
     """ List All Possible Digit Values in Empty Sudoku Position(s)
@@ -29,117 +42,433 @@ def available_digits(sudoku_array, pos_x=None, pos_y=None):
         pos_x: list of x indices of empty positions
         pos_y: list of y indices of empty positions
     """
-    if not isinstance(sudoku_array, np.ndarray):
-        raise ValueError('available_digits(): <sudoku_array> not numpy array')
-    n0 = sudoku_array.shape[0]              ## size of whole grid
-    n1 = int(n0 ** (1/2))                   ## size of inner boxes
-    if (n0 != sudoku_array.shape[1]) or (n0 != n1 ** 2):
-        raise ValueError('available_digits(): <sudoku_array> not a squared size')
-    if np.max(sudoku_array) > n0:
-        raise ValueError('available_digits(): <sudoku_array> max value overflow')
+    n0, n1 = _check_sudoku_array(sudoku_array)
     if pos_x is None and pos_y is None:     ## use all empty positions
         pos_x, pos_y = np.nonzero(sudoku_array == 0)    ## x: vertical axis
+        avail_matrix = _candidate_matrix(sudoku_array, pos_x, pos_y)
+        ## digits of all positions in one pass, then sliced per position
+        digits = (np.nonzero(avail_matrix)[1] + 1).tolist()
+        avail_digits = []
+        k = 0
+        for n_avail in np.count_nonzero(avail_matrix, axis=1).tolist():
+            avail_digits.append(digits[k:k+n_avail])
+            k = k + n_avail
     else:
         if pos_x < 0 or pos_x >= n0 or pos_y < 0 or pos_y >= n0:
             raise ValueError('available_digits(): input <pos_x/y> out of range')
+        avail_digits = [list(_available_digits_unchecked(sudoku_array,
+                                                         pos_x, pos_y, n0, n1))]
         pos_x = [pos_x]
         pos_y = [pos_y]
-
-    avail_digits = []
-    for ix, iy in zip(pos_x, pos_y):
-        ix1 = int(ix // n1)
-        iy1 = int(iy // n1)
-        exist_lst = list(sudoku_array[ix, :]) + list(sudoku_array[:, iy]) \
-           + list(sudoku_array[ix1*n1:(ix1+1)*n1, iy1*n1:(iy1+1)*n1].flatten())
-        avail_lst = list(set(range(1, 1+n0)) - set(exist_lst))
-        avail_digits.append(avail_lst)
     return avail_digits, pos_x, pos_y
 
 
+def _check_sudoku_array(sudoku_array):
+    """ Check Input Sudoku Array of available_digits() and solve_sudoku()
+    Note:
+        - errors raised under the name of available_digits(), which did
+          the check for both
+    Input:
+        sudoku_array: 2D squared numpy array, incomplete Sudoku array,
+                      and empty positions defined by 0
+    Output:
+        n0: int, size of whole grid
+        n1: int, size of inner boxes
+    """
+    if not isinstance(sudoku_array, np.ndarray):
+        raise ValueError('available_digits(): <sudoku_array> not numpy array')
+    n0 = sudoku_array.shape[0]              ## size of whole grid
+    n1 = math.isqrt(n0)                     ## size of inner boxes
+    if (n0 != sudoku_array.shape[1]) or (n0 != n1 ** 2):
+        raise ValueError('available_digits(): <sudoku_array> not a squared size')
+    if n0 > _MAX_SIZE:
+        raise ValueError('available_digits(): <sudoku_array> size over 32')
+    if np.max(sudoku_array) > n0:
+        raise ValueError('available_digits(): <sudoku_array> max value overflow')
+    return n0, n1
+
+
+def _available_digits_unchecked(sudoku_array, ix, iy, n0, n1):
+    """ List Possible Digits of A Single Position, without Input Check
+    Note:
+        - fast entry of available_digits() for a single position, whose
+          callers guarantee a valid <sudoku_array> of size n0, and
+          n1 = isqrt(n0)
+    Input:
+        sudoku_array: 2D squared numpy array, incomplete Sudoku array,
+                      and empty positions defined by 0
+        ix: int, x index of the position
+        iy: int, y index of the position
+        n0: int, size of whole grid
+        n1: int, size of inner boxes
+    Output:
+        avail_lst: tuple of possible digits for (ix, iy)
+    """
+    box_of = _box_lut(n0)
+    ix1 = box_of[ix] * n1
+    iy1 = box_of[iy] * n1
+    exist = np.concatenate((sudoku_array[ix, :], sudoku_array[:, iy],
+                            sudoku_array[ix1:ix1+n1, iy1:iy1+n1].ravel()))
+    used = np.bitwise_or.reduce(_digit_bits(exist))
+    return _mask_to_digits(used, n0)
+
+
+def _candidate_matrix(sudoku_array, pos_x, pos_y):
+    """ Possible Digits of Sudoku Positions as A Boolean Matrix
+    Note:
+        - computed for all positions at once by numpy, no Python loop
+    Input:
+        sudoku_array: 2D squared numpy array, incomplete Sudoku array,
+                      and empty positions defined by 0
+        pos_x: 1D numpy array, x indices of positions
+        pos_y: 1D numpy array, y indices of positions
+    Output:
+        avail_matrix: 2D numpy array (bool), shape (len(pos_x), n0),
+                      [i, d-1] is True if digit d possible for i-th position
+    """
+    n0 = sudoku_array.shape[0]
+    row_mask, col_mask, box_mask = _masks_from_array(sudoku_array)
+    used = row_mask[pos_x] | col_mask[pos_y] | \
+        box_mask[_box_index(n0)[pos_x, pos_y]]
+    return ((used[:, None] >> np.arange(n0, dtype=np.uint32)) & 1) == 0
+
+
+def _masks_from_array(sudoku_array):
+    """ Bitmasks of Digits Used in Each Row, Column and Inner Box
+    Note:
+        - bit (d-1) is set if digit d is used, i.e. array size <= 32
+        - inner boxes counted row by row: box of position (ix, iy) is
+          (ix//n1)*n1 + iy//n1, where n1 is size of inner boxes
+    Input:
+        sudoku_array: 2D squared numpy array, incomplete Sudoku array,
+                      and empty positions defined by 0
+    Output:
+        row_mask: 1D numpy array (uint32), used digits of each row
+        col_mask: 1D numpy array (uint32), used digits of each column
+        box_mask: 1D numpy array (uint32), used digits of each inner box
+    """
+    n0 = sudoku_array.shape[0]
+    n1 = math.isqrt(n0)
+    bits = _digit_bits(sudoku_array)
+    row_mask = np.bitwise_or.reduce(bits, axis=1)
+    col_mask = np.bitwise_or.reduce(bits, axis=0)
+    box_mask = np.bitwise_or.reduce(
+        bits.reshape(n1, n1, n1, n1).swapaxes(1, 2).reshape(n0, n0), axis=1)
+    return row_mask, col_mask, box_mask
+
+
+@lru_cache(maxsize=None)
+def _box_lut(n0):
+    """ Inner-Box Coordinate of Each Row/Column Index, for Array Size <n0>
+    Note:
+        - box of position (ix, iy) is box_of[ix]*n1 + box_of[iy]
+        - cached per size and read-only, shared by all callers
+    """
+    box_of = (np.arange(n0) // math.isqrt(n0)).astype(np.int8)
+    box_of.flags.writeable = False
+    return box_of
+
+
+@lru_cache(maxsize=None)
+def _box_index(n0):
+    """ Inner-Box Index of Each Position, for Array Size <n0>
+    Note:
+        - [ix, iy] is box_of[ix]*n1 + box_of[iy], see _box_lut(), and its
+          ravel() is indexed by flat index ix*n0 + iy
+        - cached per size and read-only, shared by all callers
+    """
+    box_of = _box_lut(n0).astype(np.uint8)
+    box_idx = box_of[:, None] * np.uint8(math.isqrt(n0)) + box_of[None, :]
+    box_idx.flags.writeable = False
+    return box_idx
+
+
+def _digit_bits(values):
+    """ Bit (d-1) for Each Digit d in Numpy Array <values>, 0 for Empty """
+    ## (1 << d) >> 1, so that no bit is set for empty position (d = 0)
+    return np.left_shift(np.uint32(1), values.astype(np.uint32)) >> 1
+
+
+## digits not set in bitmask m, for all 512 masks of 9x9 array
+_CANDIDATES_N9 = [tuple(d for d in range(1, 10) if not (m >> (d-1)) & 1)
+                  for m in range(512)]
+
+
+def _mask_to_digits(used, n0):
+    """ Tuple of Digits in [1, n0] Not Set in Bitmask <used> """
+    used = int(used)
+    if n0 == 9:
+        return _CANDIDATES_N9[used]
+    free = ~used & ((1 << n0) - 1)
+    digits = []
+    while free:                             ## scan set bits, lowest first
+        low = free & -free
+        digits.append(low.bit_length())
+        free = free ^ low
+    return tuple(digits)
+
+
+@njit(cache=True)
+def _toggle_digit(row_mask, col_mask, box_mask, ix, iy, ib, digit):
+    """ Flip Bit of <digit> in Masks of Row <ix>, Column <iy> and Box <ib>,
+        i.e. mark it as used when filled, or as unused when removed
+    """
+    bit = 1 << (int(digit) - 1)
+    row_mask[ix] ^= bit
+    col_mask[iy] ^= bit
+    box_mask[ib] ^= bit
+
+
+@njit(cache=True)
+def _rand_below(rng_state, n):
+    """ Next Random Integer in [0, n) by xorshift64, <rng_state> Updated """
+    x = rng_state[0]
+    x ^= x << np.uint64(13)
+    x ^= x >> np.uint64(7)
+    x ^= x << np.uint64(17)
+    rng_state[0] = x
+    return int(x % np.uint64(n))
+
+
+@njit(cache=True)
+def _popcount(x):
+    """ Number of Set Bits in Integer <x> of 32 Bits, i.e. a Digit Bitmask
+    Note:
+        - SWAR (SIMD within a register): bits summed in pairs, nibbles,
+          then bytes, no loop over bits
+    """
+    x = np.int64(x)
+    x = x - ((x >> 1) & 0x55555555)
+    x = (x & 0x33333333) + ((x >> 2) & 0x33333333)
+    x = (x + (x >> 4)) & 0x0F0F0F0F
+    return int(((x * 0x01010101) & 0xFFFFFFFF) >> 24)
+
+
+def _fill(board, row_mask, col_mask, box_mask, order, box_of, rng_state,
+          max_steps):
+    """ Backtracking Kernel of gen_sudoku_full(), Filling <board> in Place
+    Note:
+        - avail_stack[i, avail_head[i]:avail_len[i]] keeps the remaining
+          digits of i-th position in <order>, and the 1st one is currently
+          filled; dropping it is a bump of avail_head[i], no shift
+        - MRV (minimum remaining values): next position to fill is the
+          empty one with fewest possible digits, swapped to i-th place
+    Input:
+        board: 2D squared numpy array (int8), all positions empty (0)
+        row_mask, col_mask, box_mask: 1D numpy arrays (uint32), all 0,
+                                      updated with <board>
+        order: 1D numpy array, flat indices (ix*n0 + iy) of all positions,
+               reordered in place to the filling order
+        box_of: 1D numpy array (int8), inner-box coordinate, see _box_lut()
+        rng_state: 1D numpy array (uint64), state of random generator
+        max_steps: int, give up after so many steps, <board> left partial
+    Output:
+        n_steps: int, number of steps taken, for overhead-ratio calc,
+                 -1 if given up
+    """
+    n0 = board.shape[0]
+    n1 = int(np.sqrt(n0))
+    n_pos = len(order)
+    avail_stack = np.zeros((n_pos, n0), dtype=np.int8)
+    avail_len = np.zeros(n_pos, dtype=np.int64)
+    avail_head = np.zeros(n_pos, dtype=np.int64)
+    i = 0
+    n_steps = 0
+    while i < n_pos:
+        n_steps = n_steps + 1
+        if n_steps > max_steps:
+            return -1
+        j_min = i                            ## MRV among empty positions
+        n_min = n0 + 1
+        for j in range(i, n_pos):
+            jx = order[j] // n0
+            jy = order[j] % n0
+            jb = box_of[jx] * n1 + box_of[jy]
+            n_avail = n0 - _popcount(int(row_mask[jx] | col_mask[jy]
+                                         | box_mask[jb]))
+            if n_avail < n_min:
+                j_min = j
+                n_min = n_avail
+                if n_avail <= 1:             ## cannot do better
+                    break
+        pos = order[j_min]
+        order[j_min] = order[i]
+        order[i] = pos
+        ix = pos // n0
+        iy = pos % n0
+        ib = box_of[ix] * n1 + box_of[iy]
+        used = int(row_mask[ix] | col_mask[iy] | box_mask[ib])
+        k = 0
+        for d in range(n0):                  ## bit scan of unused digits
+            if not (used >> d) & 1:
+                avail_stack[i, k] = d + 1
+                k = k + 1
+        if k == 0:                           ## if not working, one-step back
+            ## will be empty, more steps back
+            while avail_len[i-1] - avail_head[i-1] == 1:
+                i = i - 1
+                ix = order[i] // n0
+                iy = order[i] % n0
+                ib = box_of[ix] * n1 + box_of[iy]
+                _toggle_digit(row_mask, col_mask, box_mask,
+                              ix, iy, ib, board[ix, iy])
+                board[ix, iy] = 0
+                avail_len[i] = 0
+            i = i - 1
+            ix = order[i] // n0
+            iy = order[i] % n0
+            ib = box_of[ix] * n1 + box_of[iy]
+            _toggle_digit(row_mask, col_mask, box_mask,
+                          ix, iy, ib, board[ix, iy])
+            avail_head[i] = avail_head[i] + 1    ## pop(0)
+            board[ix, iy] = avail_stack[i, avail_head[i]]
+            _toggle_digit(row_mask, col_mask, box_mask,
+                          ix, iy, ib, board[ix, iy])
+            i = i + 1
+        else:
+            for j in range(k - 1, 0, -1):        ## Fisher-Yates shuffle
+                r = _rand_below(rng_state, j + 1)
+                d = avail_stack[i, j]
+                avail_stack[i, j] = avail_stack[i, r]
+                avail_stack[i, r] = d
+            avail_len[i] = k
+            avail_head[i] = 0
+            board[ix, iy] = avail_stack[i, 0]
+            _toggle_digit(row_mask, col_mask, box_mask,
+                          ix, iy, ib, board[ix, iy])
+            i = i + 1
+    return n_steps
+
+
+_fill_checked = njit(boundscheck=True)(_fill)    ## for debugging only
+_fill = njit(cache=True)(_fill)
+
+
+def _seed_to_int(random_seed):
+    """ Convert Random Seed to A Stable 64-bit Integer for numpy Generator
+    Note:
+        - None is kept, i.e. fresh seed from OS every time
+        - integers of any type (int, numpy integers) are used as is, so
+          5 and np.int64(5) give the same seed
+        - strings are hashed by blake2b, the same across runs/platforms
+    Input:
+        random_seed: int, string or None
+    Output:
+        seed: int in [0, 2**64), or None
+    """
+    if random_seed is None:
+        return None
+    if isinstance(random_seed, numbers.Integral):
+        return int(random_seed) % 2**64
+    digest = hashlib.blake2b(str(random_seed).encode(), digest_size=8).digest()
+    return int.from_bytes(digest, 'little')
+
+
 def gen_sudoku_full(array_size=9, random_seed=None):
     """ Generate All Digits in A Squared Array That Follow Sudoku Conditions
     Input:
         array_size: int, size of Sudoku puzzle array in one dimension
-        random_seed: int or string, seed for random.shuffle(),
+        random_seed: int or string, seed for random generator,
                      to reproduce case for purpose
     Output:
         sudoku_full: 2D squared numpy array, complete Sudoku array
     """
     if (not isinstance(array_size, int)) or \
-            (array_size != int(array_size**(1/2)) ** 2):
+            (array_size != math.isqrt(array_size) ** 2):
         raise ValueError('gen_sudoku_full(): <array_size> not int or squared')
-    random.seed(random_seed)
+    if array_size > _MAX_SIZE:
+        raise ValueError('gen_sudoku_full(): <array_size> over 32')
+    rng = np.random.default_rng(_seed_to_int(random_seed))
     n0 = array_size
 
     ## generate full-array elements, one by one
-    sudoku_full = np.zeros((n0, n0), dtype=int)
-    my, mx = np.meshgrid(np.arange(0, n0), np.arange(0, n0))
-    mx = mx.flatten()                        ## mx: vertical axis
-    my = my.flatten()
-    i = 0
-    avail_lst = []
-    n_steps = 0
-    while i < len(mx):
-        n_steps = n_steps + 1                ## for overhead-ratio calc
-        a_lst, _, _ = available_digits(sudoku_full, mx[i], my[i])
-        a_lst = a_lst[0]
-        if len(a_lst) == 0:                  ## if not working, one-step back
-            while len(avail_lst[i-1]) == 1:  ## will be empty , more steps back
-                avail_lst.pop()
-                sudoku_full[mx[i-1], my[i-1]] = 0
-                i = i - 1
-            avail_lst[i-1].pop(0)
-            sudoku_full[mx[i-1], my[i-1]] = avail_lst[i-1][0]
-        else:
-            random.shuffle(a_lst)
-            sudoku_full[mx[i], my[i]] = a_lst[0]
-            avail_lst.append(a_lst)
-            i = i + 1
+    ## - a few unlucky early digits can trap backtracking for a very long
+    ##   time, so restart from empty with doubled step budget if so
+    rng_state = rng.integers(1, 2**64, size=1, dtype=np.uint64)  ## not 0
+    max_steps = 2 * n0**2
+    n_steps = -1
+    while n_steps < 0:
+        board = np.zeros((n0, n0), dtype=np.int8)
+        row_mask = np.zeros(n0, dtype=np.uint32)     ## used digits, see
+        col_mask = np.zeros(n0, dtype=np.uint32)     ##   _masks_from_array()
+        box_mask = np.zeros(n0, dtype=np.uint32)
+        order = np.arange(n0**2)                 ## flat index: ix*n0 + iy
+        n_steps = _fill(board, row_mask, col_mask, box_mask, order,
+                        _box_lut(n0), rng_state, max_steps)
+        max_steps = 2 * max_steps
+    sudoku_full = board.astype(int)
     # print('overhead ratio: ', round(n_steps/n0**2-1, 2))
     return sudoku_full
 
 
-def gen_sudoku_puzzle(sudoku_full, max_removed_ratio=None, random_seed=None):
+def gen_sudoku_puzzle(sudoku_full, max_removed_ratio=None, random_seed=None,
+                      _trust_input=False, _return_removed=False):
     """ Create a Sudoku Puzzle from Its Solution (Full Sudoku Array)
     Input:
         sudoku_full: 2D squared numpy array, complete Sudoku array
         max_removed_ratio: float, max ratio of removed array elements
-        random_seed: int or string, seed for random.shuffle(),
+        random_seed: int or string, seed for random generator,
                      to reproduce case for purpose
+        _trust_input: bool, skip checking digits of <sudoku_full>, only for
+                      internal calls on output of gen_sudoku_full()
+        _return_removed: bool, also return the removed positions, only for
+                         internal calls
     Output:
         sudo_array: 2D squared numpy array, incomplete Sudoku array,
                     as a Sudoku game
+        removed: list of flat indices (ix*n0 + iy) of removed positions,
+                 in removal order, only if <_return_removed> is True
     """
     if not isinstance(sudoku_full, np.ndarray):
         raise ValueError('gen_sudoku_puzzle(): <sudoku_array> not numpy array')
     n0 = sudoku_full.shape[0]
-    if np.max(sudoku_full) > n0 or np.min(sudoku_full) < 1:
-        raise ValueError('gen_sudoku_puzzle(): <sudoku_full> value overflow')
-    for i in range(len(sudoku_full)):
-        if len(set(sudoku_full[i])) != n0:
+    if (sudoku_full.shape[1] != n0) or (n0 != math.isqrt(n0) ** 2):
+        raise ValueError('gen_sudoku_puzzle(): <sudoku_full> not a squared size')
+    if n0 > _MAX_SIZE:
+        raise ValueError('gen_sudoku_puzzle(): <sudoku_full> size over 32')
+    if not _trust_input:
+        if np.max(sudoku_full) > n0 or np.min(sudoku_full) < 1:
+            raise ValueError('gen_sudoku_puzzle(): <sudoku_full> value overflow')
+        ## each row, column and inner box has all digits 1..n0, as
+        ##   removals below test a digit by flipping its single bit
+        n1 = math.isqrt(n0)
+        boxes = sudoku_full.reshape(n1, n1, n1, n1).swapaxes(1, 2)
+        digits = np.arange(1, 1+n0)
+        if not all(np.all(np.sort(lines, axis=1) == digits) for lines in
+                   (sudoku_full, sudoku_full.T, boxes.reshape(n0, n0))):
             raise ValueError('gen_sudoku_puzzle(): <sudoku_full> inconsistent')
     if max_removed_ratio is None:
         nmax_idx = -1                                         ## no max limit
     else:
         nmax_idx = max([1, int(max_removed_ratio * n0**2)])   ## min = 1
-    random.seed(random_seed)
+    rng = np.random.default_rng(_seed_to_int(random_seed))
 
-    my, mx = np.meshgrid(np.arange(0, n0), np.arange(0, n0))
-    mx = mx.flatten()
-    my = my.flatten()
-    idx = list(range(n0**2))
-    random.shuffle(idx)
+    idx = rng.permutation(n0**2).tolist()    ## flat index: ix*n0 + iy
     sudoku_array = sudoku_full.copy()
+    row_mask, col_mask, box_mask = [m.tolist() for m in
+                                    _masks_from_array(sudoku_array)]
+    box_idx = _box_index(n0).ravel().tolist()
+    removed = []
+    all_bits = (1 << n0) - 1
     for i in idx:
-        tmp = sudoku_array.copy()
-        tmp[mx[i], my[i]] = 0
-        a_lst, _, _ = available_digits(tmp, mx[i], my[i])
-        if len(a_lst[0]) == 1:            ## for puzzle with unique solution
-            sudoku_array[mx[i], my[i]] = 0
+        ix, iy = divmod(i, n0)
+        ib = box_idx[i]
+        bit = 1 << (int(sudoku_array[ix, iy]) - 1)
+        ## used digits if removed: masks with its bit flipped off
+        used = (row_mask[ix] ^ bit) | (col_mask[iy] ^ bit) | \
+            (box_mask[ib] ^ bit)
+        if used == all_bits ^ bit:        ## for puzzle with unique solution
+            sudoku_array[ix, iy] = 0
+            removed.append(i)
+            row_mask[ix] ^= bit
+            col_mask[iy] ^= bit
+            box_mask[ib] ^= bit
             nmax_idx = nmax_idx - 1
             if nmax_idx == 0:
                 break
 
     # removed_ratio = round(np.count_nonzero(sudoku_array == 0)/n0**2, 2)
     # print('element removed ratio: ', removed_ratio)
+    if _return_removed:
+        return sudoku_array, removed
     return sudoku_array
@@ -7,9 +7,17 @@ MIT license
 Copyright (c) 2024 ddotplus@github
 """
 
-from sudoku_utility import *
+from sudoku_generator import gen_sudoku_full, gen_sudoku_puzzle, \
+    available_digits
+from sudoku_utility import convert_index, display
 import numpy as np
 import random
+import re
+import sys
+
+## one filling string "VH=D", blank spaces removed; only a whole string
+## between commas is recognized
+_FILL_RE = re.compile(r'(?:^|(?<=,))([A-Za-z])([0-9A-Za-z])=([0-9]+)(?=,|$)')
 
 def gen_customized_puzzle(array_size=9, random_seed=None, difficulty=0.5):
     """ Generate a customized Sudoku puzzle
@@ -30,15 +38,39 @@ def gen_customized_puzzle(array_size=9, random_seed=None, difficulty=0.5):
     """
     c_solution = gen_sudoku_full(array_size, random_seed)
     ## define difficulty=1:  remove all possible positions under <random_seed>
-    puzzle_max = gen_sudoku_puzzle(c_solution, random_seed=random_seed)
-    max_removed_ratio = np.count_nonzero(puzzle_max == 0) / array_size ** 2
-    ## generate puzzle for customized difficulty
+    _, removed = gen_sudoku_puzzle(c_solution, random_seed=random_seed,
+                                   _trust_input=True, _return_removed=True)
+    max_removed_ratio = len(removed) / array_size ** 2
+    ## generate puzzle for customized difficulty: under the same seed, it
+    ## removes the leading positions of <removed>, so no need to regenerate
     removed_ratio = difficulty * max_removed_ratio
-    c_puzzle = gen_sudoku_puzzle(c_solution, max_removed_ratio=removed_ratio,
-                                 random_seed=random_seed)
+    n_removed = max([1, int(removed_ratio * array_size ** 2)])
+    c_puzzle = c_solution.copy()
+    c_puzzle.flat[removed[:n_removed]] = 0
     return c_puzzle, c_solution
 
 
+def _scan_filling(p):
+    """ Split Input into Filling Strings, Recognized or Not, in Input Order
+    Note:
+        - text between recognized strings is split by ',', and the pieces
+          with '=' are kept as unrecognized strings, others ignored
+    Input:
+        p: str, filling string(s) with blank spaces removed
+    Output:
+        tokens: list of (s, m), filling string s and its match by _FILL_RE,
+                m is None if s not recognized
+    """
+    tokens = []
+    end = 0
+    for m in _FILL_RE.finditer(p):
+        tokens += [(s, None) for s in p[end:m.start()].split(',') if '=' in s]
+        tokens.append((m.group(0), m))
+        end = m.end()
+    tokens += [(s, None) for s in p[end:].split(',') if '=' in s]
+    return tokens
+
+
 def main_sudoku_play():
     """ Interface to solve Sudoku puzzle manually
         A complete version that one may play for a while.
@@ -60,6 +92,13 @@ def main_sudoku_play():
                   '[{}]:  '.format(array_size))
     if len(p) > 0:
         array_size = int(p)
+    ## - lookup tables between array and display indices
+    disp_x_tbl, disp_y_tbl = convert_index(array_size, list(range(array_size)),
+                                           list(range(array_size)))
+    disp_x_tbl = tuple(disp_x_tbl)
+    disp_y_tbl = tuple(disp_y_tbl)
+    array_x_tbl = {c: i for i, c in enumerate(disp_x_tbl)}
+    array_y_tbl = {c: i for i, c in enumerate(disp_y_tbl)}
     ## - choose seed for puzzle generation
     random_seed = 'try_' + str(random.randint(0, 10000))
     p = input('Give a name or integer for puzzle creation:  ' +
@@ -103,6 +142,8 @@ def main_sudoku_play():
 
         ## solving the puzzle manually
         puzzle_updated = c_puzzle.copy()
+        n_total = int(np.count_nonzero(c_puzzle == 0))  ## counted only once
+        n_empty = n_total                               ## kept with updates
         help_str = ['--------------------------------------------------',
                     ' List all short-cuts:',
                     '   h:  print this help',
@@ -130,7 +171,7 @@ def main_sudoku_play():
         p = input('  > type here:  ')
         filling_lst = []  ## list of filling strings, like ["B7=8"]
         new_puzzle_now = False  ## to start a new puzzle immediately
-        while np.count_nonzero(puzzle_updated == 0) > 0 and not new_puzzle_now:
+        while n_empty > 0 and not new_puzzle_now:
             if len(p) == 0 or len(p.replace(' ', '')) == 0:
                 p = input('  >  ')
                 continue
@@ -150,12 +191,8 @@ def main_sudoku_play():
                     print('  no hint found!')
                     p = input('  >  ')
                     continue
-                pos_x_hint = [pos_x[i] for i in idx_hint]
-                pos_y_hint = [pos_y[i] for i in idx_hint]
-                disp_x_hint, disp_y_hint = convert_index(array_size,
-                                                         pos_x_hint, pos_y_hint)
-                hint_list = [disp_x_hint[i] + disp_y_hint[i] for i
-                             in range(len(idx_hint))]
+                hint_list = [disp_x_tbl[pos_x[i]] + disp_y_tbl[pos_y[i]]
+                             for i in idx_hint]
                 random.shuffle(hint_list)
                 if N != 'a':
                     hint_list = hint_list[:min([int(N), len(idx_hint)])]
@@ -177,6 +214,7 @@ def main_sudoku_play():
                       [array_size, random_seed, difficulty])
                 display(c_puzzle)
                 puzzle_updated = c_puzzle.copy()
+                n_empty = n_total
                 filling_lst = []
             elif p.lower() == 'n':  ## start a new puzzle now
                 new_puzzle_now = True
@@ -185,32 +223,28 @@ def main_sudoku_play():
                 print('')
                 print('Quit the game now ...')
                 print('  puzzle ID:', [array_size, random_seed, difficulty])
-                n_remained = np.count_nonzero(puzzle_updated == 0)
-                n_total = np.count_nonzero(c_puzzle == 0)
+                n_remained = n_empty
                 print('  empty positions (remained/total): {}/{}={}'.format(
                     n_remained, n_total, round(n_remained / n_total), 3))
                 print('')
-                exit(0)
+                sys.exit(0)
             elif '=' in p:  ## filling empty positions
                 filling_new = []
                 error_lst = []
-                for s in p.split(','):
-                    if not ('=' in s):
-                        continue
-                    s_clean = s.replace(' ', '')
-                    t = s_clean.split('=')
-                    if not (len(t[0]) == 2 and t[1].isdigit()):
-                        error_lst.append(s_clean)
+                for s, m in _scan_filling(p.replace(' ', '')):
+                    if m is None:
+                        error_lst.append(s)
                         continue
-                    try:
-                        x, y = convert_index(array_size, t[0][0], t[0][1])
-                        if c_solution[x[0], y[0]] == int(t[1]):
-                            filling_new.append(s_clean)
-                            puzzle_updated[x[0], y[0]] = int(t[1])
-                        else:
-                            error_lst.append(s_clean)
-                    except Exception:
-                        error_lst.append(s_clean)
+                    x = array_x_tbl.get(m.group(1).upper())
+                    y = array_y_tbl.get(m.group(2).lower())
+                    if x is not None and y is not None and \
+                            c_solution[x, y] == int(m.group(3)):
+                        filling_new.append(s)
+                        if puzzle_updated[x, y] == 0:   ## not filled before
+                            n_empty = n_empty - 1
+                        puzzle_updated[x, y] = int(m.group(3))
+                    else:
+                        error_lst.append(s)
                 if len(error_lst) > 0:
                     print('  incorrect filling string(s):')
                     print('       ', ','.join(error_lst))
@@ -220,7 +254,7 @@ def main_sudoku_play():
                     filling_lst = filling_lst + filling_new
                     print('  {} position(s) updated'.format(len(filling_new)))
                     display(c_puzzle, filling_lst)
-                    if np.count_nonzero(puzzle_updated == 0) == 0:
+                    if n_empty == 0:
                         print('🎉🎉🎉  Bingo! 🎉🎉🎉')
                         print('You completed the puzzle:',
                               [array_size, random_seed, difficulty])
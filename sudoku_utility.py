@@ -9,58 +9,284 @@ MIT license
 Copyright (c) 2024 ddotplus@github
 """
 
-from sudoku_generator import *
+from sudoku_generator import _check_sudoku_array, _masks_from_array, \
+    _box_lut, _box_index, _popcount, njit
+from functools import lru_cache
 import numpy as np
+import string
 
-def solve_sudoku(sudoku_array):
+## event codes of _search_kernel(), see _replay_events()
+_DEADEND = 0
+_SOLVED = 1
+_BRANCH = 2
+_BRANCH_END = 3
+
+def solve_sudoku(sudoku_array, verbose=False):
     """ Find Solution(s) to A Given Sodoku Puzzle
     Input:
         sudoku_array: 2D squared numpy array, incomplete Sudoku array,
                       and empty positions defined by 0
+        verbose: bool, print solutions found under each sub-branch
     Output:
         sudoku_solutions: list of 2D numpy array, a list of complete Sudoku
                           solutions
         solving_record: nested list, record num of positions filled in
                         the process of finding solution(s)
     """
-    sudoku_arr = sudoku_array.copy()
-    n0_zeros = len(sudoku_arr[sudoku_arr == 0])
-    n_zeros = n0_zeros
-    sudoku_solutions = []
-    solving_record = []
-    while n_zeros > 0:
-        avail_lst, pos_x, pos_y = available_digits(sudoku_arr)
-        n_avail = [len(a) for a in avail_lst]
-        if min(n_avail) == 0:                 ## see deadend, give up
-            solving_record.append(
-                            n_zeros - len(sudoku_arr[sudoku_arr == 0]))
-            return None, solving_record
-        elif min(n_avail) == 1:               ## normal cases, do iterations
-            indices = [i for i, n in enumerate(n_avail) if n == 1]
-            for idx in indices:
-                sudoku_arr[pos_x[idx], pos_y[idx]] = avail_lst[idx][0]
-            n_zeros = len(sudoku_arr[sudoku_arr == 0])
-        else:         ## sub-branch searching, potentially multiple solutions
-            indices = [i for i, n in enumerate(n_avail) if n == min(n_avail)]
-            record_indices = [n0_zeros-n_zeros]
-            for idx in indices:
-                record_idx = []
-                for val in avail_lst[idx]:
-                    tmp = sudoku_arr.copy()
-                    tmp[pos_x[idx], pos_y[idx]] = val
-                    tmp_solved, tmp_record = solve_sudoku(tmp)
-                    record_idx.append(tmp_record)
-                    if not (tmp_solved is None):
-                        sudoku_solutions = sudoku_solutions + tmp_solved
-                        print('')
-                        print(tmp_solved)
-                record_indices.append(record_idx)
-            solving_record.append(record_indices)
-            break
-    if len(solving_record) == 0:                  ## no sub-branch searching
-        sudoku_solutions = [sudoku_arr]
-        solving_record.append([n0_zeros-n_zeros, sudoku_arr])
-    return sudoku_solutions, solving_record
+    n0, _ = _check_sudoku_array(sudoku_array)
+    ## possible digits of each empty position as bitmask, 0 if filled,
+    ## for all positions at once by numpy
+    row_mask, col_mask, box_mask = _masks_from_array(sudoku_array)
+    used = row_mask[:, None] | col_mask[None, :] | box_mask[_box_index(n0)]
+    is_empty = sudoku_array == 0
+    n_empty = int(np.count_nonzero(is_empty))       ## counted only once here
+    cand = np.where(is_empty, ~used & np.uint32((1 << n0) - 1), 0)
+    deadend = bool(np.any(is_empty & (cand == 0)))
+    singles = np.flatnonzero(is_empty & ((cand & (cand - 1)) == 0))
+
+    ## the only copy of <sudoku_array>, filled and undone in place by kernel
+    board = sudoku_array.astype(np.int64).ravel()
+    cand = cand.ravel().astype(np.int64)
+    if n0 == 9:                     ## the most common size, see _search_9x9()
+        events, solutions = _search_9x9(board, cand, singles, deadend,
+                                        n_empty)
+    else:
+        events, solutions = _search_kernel(board, cand, _peers(n0), singles,
+                                           deadend, n_empty)
+    return _replay_events(events, solutions, n0, sudoku_array.dtype, verbose)
+
+
+@lru_cache(maxsize=None)
+def _peers(n0):
+    """ Peers of Each Position, i.e. Others in Its Row, Column and Box
+    Output:
+        peers: 2D numpy array (read-only), [i, :] is flat indices
+               (ix*n0 + iy) of peers of i-th position
+    """
+    pos_x, pos_y = np.divmod(np.arange(n0**2), n0)
+    box_idx = _box_index(n0).ravel()
+    peers = []
+    for i in range(n0**2):
+        same = (pos_x == pos_x[i]) | (pos_y == pos_y[i]) | \
+            (box_idx == box_idx[i])
+        same[i] = False
+        peers.append(np.flatnonzero(same))
+    peers = np.array(peers, dtype=np.int64)
+    peers.flags.writeable = False
+    return peers
+
+
+@njit(cache=True, inline='always')
+def _place_digit(board, cand, peers, trail, changed, queue,
+                 n_trail, n_changed, q_tail, i, bit):
+    """ Fill Position <i> with Digit of <bit>, Dropping It from Peers
+    Note:
+        - trail[k] = (i, cand[i], bit, end of its peers in <changed>) of
+          k-th filled position, see _undo_digits()
+        - peers left with a single digit are appended to <queue>
+    Output:
+        ok: bool, False if the digit not possible, i.e. nothing filled, or
+            a peer left without any possible digit (deadend)
+        n_trail, n_changed, q_tail: updated lengths of trail/changed/queue
+    """
+    if (cand[i] & bit) == 0:
+        return False, n_trail, n_changed, q_tail
+    ok = True
+    d = 0
+    b = bit
+    while b:                                ## digit of <bit>
+        b >>= 1
+        d = d + 1
+    board[i] = d
+    for k in range(peers.shape[1]):
+        p = peers[i, k]
+        c = cand[p]
+        if c & bit:
+            c = c ^ bit
+            cand[p] = c
+            changed[n_changed] = p
+            n_changed = n_changed + 1
+            if c == 0:
+                ok = False
+                break
+            if c & (c - 1) == 0:
+                queue[q_tail] = p
+                q_tail = q_tail + 1
+    trail[n_trail, 0] = i
+    trail[n_trail, 1] = cand[i]
+    trail[n_trail, 2] = bit
+    trail[n_trail, 3] = n_changed
+    cand[i] = 0
+    return ok, n_trail + 1, n_changed, q_tail
+
+
+@njit(cache=True, inline='always')
+def _undo_digits(board, cand, trail, changed, n_trail, n_keep):
+    """ Undo Filled Positions in <trail>, Until Its Length is <n_keep>
+    Output:
+        n_trail, n_changed: updated lengths of trail/changed
+    """
+    while n_trail > n_keep:
+        n_trail = n_trail - 1
+        i = trail[n_trail, 0]
+        bit = trail[n_trail, 2]
+        board[i] = 0
+        cand[i] = trail[n_trail, 1]
+        start = trail[n_trail - 1, 3] if n_trail > 0 else 0
+        for k in range(start, trail[n_trail, 3]):
+            cand[changed[k]] = cand[changed[k]] | bit
+    n_changed = trail[n_trail - 1, 3] if n_trail > 0 else 0
+    return n_trail, n_changed
+
+
+@njit(cache=True, inline='always')
+def _search_kernel(board, cand, peers, singles, deadend, n_empty):
+    """ Depth-First Search Kernel of solve_sudoku()
+    Note:
+        - no recursion or array copies: filled positions are kept in
+          <trail>, and undone by flipping their bits back in <cand>
+        - naked singles are filled by propagation to peers, and branching
+          on the first position of minimum remaining values (MRV)
+    Input:
+        board: 1D numpy array (int64), flat Sudoku array, filled in place
+        cand: 1D numpy array (int64), bitmask of possible digits of each
+              position, 0 if filled, updated with <board>
+        peers: 2D numpy array, see _peers()
+        singles: 1D numpy array, positions with a single possible digit
+        deadend: bool, if any empty position without possible digit
+        n_empty: int, num of empty positions in <board>, then all filled
+                 when <trail> has so many entries
+    Output:
+        events: list of int, (code, num of positions filled) of each node
+                of search tree in depth-first order, see _replay_events()
+        solutions: list of 1D numpy array (uint8), snapshot of <board> at
+                   each code of _SOLVED in <events>
+    """
+    n_pos = board.shape[0]
+    trail = np.zeros((n_empty + 1, 4), dtype=np.int64)
+    changed = np.zeros((n_empty + 1) * peers.shape[1], dtype=np.int64)
+    queue = np.zeros(n_pos, dtype=np.int64)
+    stack = np.zeros((n_empty + 1, 3), dtype=np.int64)  ## (i, cand, n_trail)
+    events = [np.int64(0) for _ in range(0)]
+    solutions = [np.zeros(0, dtype=np.uint8) for _ in range(0)]
+
+    q_head = 0
+    q_tail = len(singles)
+    queue[:q_tail] = singles
+    n_trail = 0
+    n_changed = 0
+    n_stack = 0
+    n_trail_node = 0                        ## n_trail when current node begun
+    while True:
+        ## fill naked singles found by propagation, until deadend or none
+        while q_head < q_tail and not deadend:
+            i = queue[q_head]
+            q_head = q_head + 1
+            if cand[i]:                         ## not filled yet
+                ok, n_trail, n_changed, q_tail = _place_digit(
+                    board, cand, peers, trail, changed, queue,
+                    n_trail, n_changed, q_tail, i, cand[i])
+                deadend = not ok
+        events.append(np.int64(_DEADEND if deadend else
+                               _SOLVED if n_trail == n_empty else _BRANCH))
+        events.append(np.int64(n_trail - n_trail_node))
+        if deadend:
+            pass
+        elif n_trail == n_empty:             ## one copy of n_pos bytes
+            solutions.append(board.astype(np.uint8))
+        else:
+            i_min = -1                          ## one position of MRV
+            n_min = 64
+            for i in range(n_pos):
+                c = cand[i]
+                if c == 0:                      ## filled
+                    continue
+                c &= c - 1                      ## no singles left here, so
+                if c & (c - 1) == 0:            ##   two digits is the best,
+                    i_min = i                   ##   taken without counting
+                    break
+                n_avail = _popcount(cand[i])
+                if n_avail < n_min:
+                    i_min = i
+                    n_min = n_avail
+            stack[n_stack, 0] = i_min
+            stack[n_stack, 1] = cand[i_min]
+            stack[n_stack, 2] = n_trail
+            n_stack = n_stack + 1
+
+        ## move to next digit of innermost branching position
+        while n_stack > 0:
+            n_trail, n_changed = _undo_digits(board, cand, trail, changed,
+                                              n_trail, stack[n_stack-1, 2])
+            if stack[n_stack-1, 1]:
+                break
+            n_stack = n_stack - 1               ## all digits tried
+            events.append(np.int64(_BRANCH_END))
+            events.append(np.int64(0))
+        if n_stack == 0:
+            return events, solutions
+        i = stack[n_stack-1, 0]
+        c = stack[n_stack-1, 1]
+        bit = c & -c                            ## lowest digit first
+        stack[n_stack-1, 1] = c ^ bit
+        q_head = 0
+        q_tail = 0
+        ok, n_trail, n_changed, q_tail = _place_digit(
+            board, cand, peers, trail, changed, queue,
+            n_trail, n_changed, q_tail, i, bit)
+        deadend = not ok
+        n_trail_node = n_trail
+
+
+## peers of 9x9 Sudoku, a global array taken as constant by numba
+_PEERS_9 = _peers(9)
+
+@njit(cache=True)
+def _search_9x9(board, cand, singles, deadend, n_empty):
+    """ _search_kernel() Specialized for 9x9 Sudoku
+    Note:
+        - with _search_kernel() and its helpers inlined, numba compiles
+          sizes of <_PEERS_9> and the loops over peers as constants
+    """
+    return _search_kernel(board, cand, _PEERS_9, singles, deadend, n_empty)
+
+
+def _replay_events(events, solutions, n0, dtype, verbose=False):
+    """ Build Output of solve_sudoku() from Events of _search_kernel()
+    Input:
+        events, solutions: see _search_kernel()
+        n0: int, size of Sudoku array
+        dtype: numpy dtype of solutions
+        verbose: bool, see solve_sudoku()
+    Output:
+        sudoku_solutions, solving_record: see solve_sudoku()
+    """
+    branches = []                   ## [n_filled, solutions, record_idx]
+    solutions = iter(solutions)
+    k = 0
+    while k < len(events):
+        code, n_filled = int(events[k]), int(events[k+1])
+        k = k + 2
+        if code == _BRANCH:
+            branches.append([n_filled, [], []])
+            continue
+        if code == _DEADEND:                    ## see deadend, give up
+            result = None, [n_filled]
+        elif code == _SOLVED:
+            solution = next(solutions).reshape(n0, n0).astype(dtype)
+            result = [solution], [[n_filled, solution]]
+        else:                                   ## all digits tried
+            n_filled, sudoku_solutions, record_idx = branches.pop()
+            result = sudoku_solutions, [[n_filled, record_idx]]
+        if len(branches) > 0:
+            tmp_solved, tmp_record = result
+            branches[-1][2].append(tmp_record)
+            if not (tmp_solved is None):
+                branches[-1][1] += tmp_solved
+                if verbose:
+                    print('')
+                    print(tmp_solved)
+    return result
 
 
 def convert_index(array_size, pos_x, pos_y):
@@ -89,10 +315,7 @@ def convert_index(array_size, pos_x, pos_y):
         if len(pos_x) != len(pos_y):
             raise ValueError('convert_index(): <pos_x/y> unpaired')
 
-    import string
-    array_xy = list(range(array_size))
-    display_x = list(string.ascii_uppercase[:array_size])
-    display_y = list(string.printable[1:1+array_size])
+    _, _, x_to_idx, y_to_idx, idx_to_x, idx_to_y = _index_tables(array_size)
 
     pos_x_converted = []
     pos_y_converted = []
@@ -100,18 +323,40 @@ def convert_index(array_size, pos_x, pos_y):
         if isinstance(x, str) and isinstance(y, str):
             x = x.upper()                   ## for case insensitive
             y = y.lower()
-            if not (x in display_x) or not (y in display_y):
+            if not (x in x_to_idx) or not (y in y_to_idx):
                 raise ValueError('convert_index(): x or y overflow:', x, y)
-            pos_x_converted.append(array_xy[display_x.index(x)])
-            pos_y_converted.append(array_xy[display_y.index(y)])
+            pos_x_converted.append(x_to_idx[x])
+            pos_y_converted.append(y_to_idx[y])
         elif x == int(x) and y == int(y):
-            if x < 0 or x > array_size or y < 0 or y > array_size:
+            if x < 0 or x >= array_size or y < 0 or y >= array_size:
                 raise ValueError('convert_index(): x or y overflow:', x, y)
-            pos_x_converted.append(display_x[array_xy.index(x)])
-            pos_y_converted.append(display_y[array_xy.index(y)])
+            pos_x_converted.append(idx_to_x[x])
+            pos_y_converted.append(idx_to_y[y])
     return pos_x_converted, pos_y_converted
 
 
+@lru_cache(maxsize=None)
+def _index_tables(array_size):
+    """ Array and Display Indices for Array Size <array_size>
+    Note:
+        - cached per size and shared, so not to be modified by callers
+    Output:
+        display_x: tuple of str, display x indices, e.g. ('A','B',...)
+        display_y: tuple of str, display y indices, e.g. ('1',...,'a',...)
+        x_to_idx: dict, array index of each display x index
+        y_to_idx: dict, array index of each display y index
+        idx_to_x: dict, display x index of each array index
+        idx_to_y: dict, display y index of each array index
+    """
+    display_x = tuple(string.ascii_uppercase[:array_size])
+    display_y = tuple(string.printable[1:1+array_size])
+    x_to_idx = {c: i for i, c in enumerate(display_x)}
+    y_to_idx = {c: i for i, c in enumerate(display_y)}
+    idx_to_x = dict(enumerate(display_x))
+    idx_to_y = dict(enumerate(display_y))
+    return display_x, display_y, x_to_idx, y_to_idx, idx_to_x, idx_to_y
+
+
 def display(sudoku_array, filling_list=None, hint_list=None, digit=None):
     """ Box-drawing of Sudoku puzzle with a color scheme
     Note:
@@ -139,7 +384,7 @@ def display(sudoku_array, filling_list=None, hint_list=None, digit=None):
         raise ValueError('display(): <sudoku_array> size not squared ')
     ## generate display indices
     nd = len(str(n0))                       ## number of digits that <n0> has
-    display_x, display_y = convert_index(n0, list(range(n0)), list(range(n0)))
+    display_x, display_y, x_to_idx, y_to_idx, _, _ = _index_tables(n0)
     ## check and convert filling_list
     if isinstance(filling_list, str):
         filling_list = [filling_list]
@@ -147,26 +392,24 @@ def display(sudoku_array, filling_list=None, hint_list=None, digit=None):
         if not all(['=' in s for s in filling_list]):
             raise ValueError('display(): <filling_list> missing "="')
         f_lst = [s.replace(' ', '').split('=') for s in filling_list]
-        if not all([len(s[0]) == 2 and s[0][0].upper() in display_x
-                    and s[0][1].lower() in display_y for s in f_lst]):
+        if not all([len(s[0]) == 2 and s[0][0].upper() in x_to_idx
+                    and s[0][1].lower() in y_to_idx for s in f_lst]):
             raise ValueError('display(): <filling_list> display indices error')
         if not all([0 < int(s[1]) <= n0 for s in f_lst]):
             raise ValueError('display(): <filling_list> filled value overflow')
-        for i in range(len(f_lst)):
+        for i in range(len(f_lst)):             ## convert to array indices
             t = f_lst[i][0]
-            ax, ay = convert_index(n0, t[0], t[1])  ## convert to array indices
-            f_lst[i] = [ax[0], ay[0], f_lst[i][1]]  ## will be used in display
+            f_lst[i] = [x_to_idx[t[0].upper()], y_to_idx[t[1].lower()],
+                        f_lst[i][1]]                ## will be used in display
     ## check and convert hint_list
     if isinstance(hint_list, str):
         hint_list = [hint_list]
     if not (hint_list is None):
-        if not all([len(s)==2 and s[0] in display_x
-                    and s[1] in display_y for s in hint_list]):
+        if not all([len(s)==2 and s[0] in x_to_idx
+                    and s[1] in y_to_idx for s in hint_list]):
             raise ValueError('display(): <hint_list> display indices error')
-        h_lst = hint_list.copy()
-        for i in range(len(h_lst)):                ## convert to array indices
-            ax, ay = convert_index(n0, h_lst[i][0], h_lst[i][1])
-            h_lst[i] = [ax[0], ay[0]]              ## will be used in display
+        h_lst = [[x_to_idx[s[0]], y_to_idx[s[1]]]  ## convert to array indices
+                 for s in hint_list]               ## will be used in display
     ## check <digit>
     if not (digit is None):
         if (isinstance(digit, str) and digit.isdigit()) or \
@@ -196,49 +439,59 @@ def display(sudoku_array, filling_list=None, hint_list=None, digit=None):
             '\033[' + font_type + digi_color + digi_bg]  ## for not filled
     ending = '\033[0;0m'
     # print(hint[0] + 'hint' + ending, fill[0] + 'fill' + ending)  ## for test
+    space = [normal[0] + ' ' + ending,     ## spaces around each cell
+             normal[1] + ' ' + ending]
+    fmt = '{:' + str(nd) + 'd}'             ## for cell value
+
+    ## array indices of hints, and filled value of each filled position
+    hint_set = set()
+    if not (hint_list is None):
+        hint_set = set((x, y) for x, y in h_lst)
+    fill_map = {}
+    if not (filling_list is None or len(filling_list) == 0):
+        for x, y, v in f_lst:
+            fill_map.setdefault((x, y), int(v))    ## first one if repeated
+
+    ## background style (0 or 1) of each position, by its inner box
+    box_of = _box_lut(n0)
+    bg = ((box_of[:, None] + box_of[None, :]) % 2).tolist()
 
     ## start box-draw
     top_bottom = ' '*(nd+2)+(' '*(nd+1)).join(display_y) ## horizontal indices
     boxdraw = [top_bottom]
     for ix in range(n0):
-        line = []
+        line = [display_x[ix], ' ']     ## pieces of line, joined once
         for iy in range(n0):
-            t = ''
             t_show = 'normal'
             if sudoku_array[ix, iy] == 0:          ## replace empty position
-                if not (hint_list is None):        ##   by hint symbol
-                    if len([x for x, y in h_lst if x == ix and y == iy]) > 0:
-                        t = u"\u2587" * nd
-                        t_show = 'hint'
-                                                   ##   by filled value
-                if not (filling_list is None or len(filling_list) == 0):
-                    t = [int(v) for x, y, v in f_lst if x == ix and y == iy]
-                    if len(t) > 0:
-                        if t[0] == digit:
-                            t_show = 'fill_digi'
-                        else:
-                            t_show = 'fill'
-                        t = ('{:' + str(nd) + 'd}').format(t[0])
-                if len(t) == 0:
-                    t = u"\u2587" * nd
+                t = u"\u2587" * nd
+                if (ix, iy) in hint_set:           ##   by hint symbol
+                    t_show = 'hint'
+                v = fill_map.get((ix, iy))         ##   by filled value
+                if not (v is None):
+                    if v == digit:
+                        t_show = 'fill_digi'
+                    else:
+                        t_show = 'fill'
+                    t = fmt.format(v)
             else:
-                t = ('{:'+str(nd)+'d}').format(sudoku_array[ix, iy])
+                t = fmt.format(sudoku_array[ix, iy])
             ## apply font/background color
-            bg_index = ((ix // n1) + (iy // n1)) % 2    ## 0 or 1
-            t_space = normal[bg_index] + ' ' + ending
+            bg_index = bg[ix][iy]
             if t_show == 'hint':
-                t = hint[bg_index] + t + ending
+                color = hint[bg_index]
             elif t_show == 'fill':
-                t = fill[bg_index] + t + ending
+                color = fill[bg_index]
             elif t_show == 'fill_digi':
-                t = digi[0] + t + ending
+                color = digi[0]
             elif sudoku_array[ix, iy] == digit:
-                t = digi[1] + t + ending
+                color = digi[1]
             else:
-                t = normal[bg_index] + t + ending
-            line.append(t_space + t + t_space)
-        line = display_x[ix] + ' ' + ''.join(line) + ' ' + display_x[ix]
-        boxdraw.append(line)
+                color = normal[bg_index]
+            t_space = space[bg_index]
+            line.extend((t_space, color, t, ending, t_space))
+        line.extend((' ', display_x[ix]))
+        boxdraw.append(''.join(line))
     boxdraw.append(top_bottom)
     ## display box-draw
     hspace = [20, 10, 5, 3]     ## for array size: 4/9/16/25